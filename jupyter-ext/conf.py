@@ -9,6 +9,15 @@ jupyter_conversion_mode = "all"
 
 jupyter_write_metadata = True
 
+# Validate generated notebooks against the nbformat schema (slow)
+jupyter_validate = False
+
+# Maximum number of documents per worker batch when building with -j N
+jupyter_parallel_batch_size = 200
+
+# Write serially, even with -j N, when this many documents or fewer are written
+jupyter_parallel_min_docs = 500
+
 # Location for _static folder
 jupyter_static_file_path = ["_static"]
 
@@ -9,10 +9,16 @@
 from enum import Enum
 from xml.etree.ElementTree import ElementTree
 import os.path
-import codecs
+import copy
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import io
+import json
+import types
 import xml.sax.saxutils
 import nbformat
+from nbformat.v4.rwbase import split_lines
 from nbconvert.preprocessors import ExecutePreprocessor
 import docutils
 from sphinx.builders import Builder
@@ -20,6 +26,7 @@ from sphinx.util.osutil import ensuredir, os_path, relative_uri, movefile, copyf
 from sphinx.util.console import bold, darkgreen, brown
 from sphinx.util.matching import Matcher
 from sphinx.util.fileutil import copy_asset
+import sphinx.builders
 import re
 
 
@@ -42,31 +49,7 @@ the vast majority of languages do not need any translation between Sphinx and Ju
 """
 class LanguageTranslator:
     def __init__(self, templatePaths):
-        self.translator = dict()
-
-        sourceFile = "languages.xml"
-        for potentialPath in templatePaths:
-            fullFilename = os.path.normpath(potentialPath + "/" + sourceFile)
-            if os.path.isfile(fullFilename):
-                xmlParser = ElementTree()
-                xmlRoot = xmlParser.parse(fullFilename)
-
-                languages = xmlRoot.findall("language")
-                for language in languages:
-                    sphinxLang = None
-                    jupyterLang = None
-
-                    for child in language:
-                        if child.tag == "sphinx-name":
-                            sphinxLang = child.text
-                        elif child.tag == "jupyter-name":
-                            jupyterLang = child.text
-
-                    if sphinxLang and jupyterLang:
-                        self.translator[sphinxLang] = jupyterLang
-                    else:
-                        # Explicit silent failure; ignore malformed data.
-                        pass
+        self.translator = _load_language_map(templatePaths)
 
 
     """
@@ -75,7 +58,47 @@ class LanguageTranslator:
     If the language is not found in the dictionary, return the name that was given.
     """
     def translate(self, sphinxLanguageName):
-        return self.translator[sphinxLanguageName] if sphinxLanguageName in self.translator else sphinxLanguageName
+        return self.translator.get(sphinxLanguageName, sphinxLanguageName)
+
+
+"""
+Parses languages.xml from the given template paths into a read-only mapping.
+
+The builder creates one LanguageTranslator per build, so this runs once per
+build rather than once per document.
+"""
+def _load_language_map(templatePaths):
+    translator = dict()
+
+    sourceFile = "languages.xml"
+    for potentialPath in templatePaths:
+        fullFilename = os.path.normpath(potentialPath + "/" + sourceFile)
+        if os.path.isfile(fullFilename):
+            xmlParser = ElementTree()
+            xmlRoot = xmlParser.parse(fullFilename)
+
+            languages = xmlRoot.findall("language")
+            for language in languages:
+                sphinxLang = None
+                jupyterLang = None
+
+                for child in language:
+                    if child.tag == "sphinx-name":
+                        sphinxLang = child.text
+                    elif child.tag == "jupyter-name":
+                        jupyterLang = child.text
+
+                if sphinxLang and jupyterLang:
+                    translator[sphinxLang] = jupyterLang
+                else:
+                    # Explicit silent failure; ignore malformed data.
+                    pass
+
+    return types.MappingProxyType(translator)
+
+
+# Fenced markdown code block: language, code
+MARKDOWN_CODE_FENCE = "```{}\n{}\n```\n"
 
 
 class JupyterOutputCellGenerators(Enum):
@@ -111,21 +134,61 @@ class JupyterOutputCellGenerators(Enum):
     def Generate(self, formatted_text, translator):
         res = None
         if self is JupyterOutputCellGenerators.CODE:
-            res = nbformat.v4.new_code_cell(formatted_text)
+            res = _mk_code_cell(formatted_text)
         elif self is JupyterOutputCellGenerators.CODE_OUTPUT:
-            res = nbformat.v4.new_output(output_type="stream", text=formatted_text)
+            res = _mk_stream_output(formatted_text)
         elif self is JupyterOutputCellGenerators.MARKDOWN:
             # Add triple backticks and the name of the language to the code block,
             # so that Jupyter renders the markdown correctly.
             language = translator.nodelang if translator.nodelang else ""
-            raw_markdown = "```" + language + "\n" + formatted_text + "\n```\n"
-            res = nbformat.v4.new_markdown_cell(raw_markdown)
+            raw_markdown = MARKDOWN_CODE_FENCE.format(language, formatted_text)
+            res = _mk_markdown_cell(raw_markdown)
         else:
             raise Exception("Invalid output cell type passed to JupyterOutputCellGenerator.Generate.")
 
         return res
 
 
+"""
+Lightweight cell constructors.
+
+These build the same structures as nbformat.v4.new_code_cell, new_markdown_cell
+and new_output, but skip the per-cell schema validation done by nbformat; the
+finished notebook is only validated when jupyter_validate is set.
+"""
+# nbformat 4.5 (written by nbformat >= 5.1) requires an id on every cell
+_CELL_IDS = nbformat.v4.nbformat_minor >= 5
+
+
+def _mk_code_cell(source):
+    cell = nbformat.NotebookNode(
+        cell_type="code",
+        metadata=nbformat.NotebookNode(),
+        execution_count=None,
+        source=source,
+        outputs=[])
+    if _CELL_IDS:
+        cell.id = nbformat.v4.nbbase.random_cell_id()
+    return cell
+
+
+def _mk_markdown_cell(source):
+    cell = nbformat.NotebookNode(
+        cell_type="markdown",
+        metadata=nbformat.NotebookNode(),
+        source=source)
+    if _CELL_IDS:
+        cell.id = nbformat.v4.nbbase.random_cell_id()
+    return cell
+
+
+def _mk_stream_output(text):
+    return nbformat.NotebookNode(
+        output_type="stream",
+        name="stdout",
+        text=text)
+
+
 class JupyterWriter(docutils.writers.Writer):
     def __init__(self, builder):
         docutils.writers.Writer.__init__(self)
@@ -164,11 +227,21 @@ class JupyterWriter(docutils.writers.Writer):
             self.document)
 
         self.document.walkabout(visitor)
-        self.output = nbformat.writes(visitor.output)
+        # serialized by the builder straight to the output file
+        self.output = visitor.output
 
 
 class JupyterCodeTranslator(docutils.nodes.GenericNodeVisitor):
 
+    # NodeVisitor has no __slots__, so instances keep a __dict__; slots just
+    # give the attributes used on every node visit faster access
+    __slots__ = (
+        "lang", "nodelang", "langTranslator", "warn", "error", "settings",
+        "builder", "source_file_name", "default_lang", "output", "_cells",
+        "jupyter_kernels", "jupyter_headers", "jupyter_write_metadata",
+        "in_code_block", "output_cell_type", "code_lines",
+        "_visit_dispatch", "_depart_dispatch")
+
     URI_SPACE_REPLACE_FROM = re.compile(r"\s")
     URI_SPACE_REPLACE_TO = "-"
 
@@ -178,7 +251,7 @@ class JupyterCodeTranslator(docutils.nodes.GenericNodeVisitor):
         self.lang     = None
         self.nodelang = None
 
-        self.langTranslator = LanguageTranslator(builder.config["templates_path"])
+        self.langTranslator = builder._lang_translator
 
         # Reporter
         self.warn = self.document.reporter.warning
@@ -194,49 +267,46 @@ class JupyterCodeTranslator(docutils.nodes.GenericNodeVisitor):
         
         # Create output notebook
         self.output = nbformat.v4.new_notebook()
+        self._cells = self.output["cells"]
 
         # Variables defined in conf.py
         self.jupyter_kernels = builder.config["jupyter_kernels"]
         self.jupyter_headers = builder.config["jupyter_headers"]
         self.jupyter_write_metadata = builder.config["jupyter_write_metadata"]
 
-        # Welcome message block
-        template_paths = builder.config["templates_path"]
-        welcome_block_filename = builder.config["jupyter_welcome_block"]
-
-        full_path_to_welcome = None
-        for template_path in template_paths:
-            if os.path.isfile(template_path + "/" + welcome_block_filename):
-                full_path_to_welcome = os.path.normpath(template_path + "/" + welcome_block_filename)
-
-        if full_path_to_welcome:
-            with open(full_path_to_welcome) as input_file:
-                lines = input_file.readlines()
-
-            line_text = "".join(lines)
-            formatted_line_text = self.strip_blank_lines_in_end_of_block(line_text)
-            nb_header_block = nbformat.v4.new_markdown_cell(formatted_line_text)
-
-            # Add the welcome block to the output stream straight away
-            self.output["cells"].append(nb_header_block)
-
-        # Write metadata
-        if self.jupyter_write_metadata:
-            meta_text = \
-                "Notebook created: {:%Y-%m-%d %H:%M:%S}  \n"\
-                "Generated from: {}  "
-
-            metadata = meta_text.format(
-                datetime.datetime.now(),
-                self.source_file_name)
-
-            self.output["cells"].append(nbformat.v4.new_markdown_cell(metadata))
-
         # Variables used in visit/depart
         self.in_code_block = False # if False, it means in markdown_cell
         self.output_cell_type = None
         self.code_lines = []
 
+        # Bound visit/depart methods, keyed by node class
+        self._visit_dispatch = {}
+        self._depart_dispatch = {}
+
+    # dispatch
+    # --------
+    def dispatch_visit(self, node):
+        """look up visit_<node> once per node class instead of per node
+        """
+        node_class = node.__class__
+        method = self._visit_dispatch.get(node_class)
+        if method is None:
+            method = getattr(
+                self, "visit_" + node_class.__name__, self.unknown_visit)
+            self._visit_dispatch[node_class] = method
+        return method(node)
+
+    def dispatch_departure(self, node):
+        """look up depart_<node> once per node class instead of per node
+        """
+        node_class = node.__class__
+        method = self._depart_dispatch.get(node_class)
+        if method is None:
+            method = getattr(
+                self, "depart_" + node_class.__name__, self.unknown_departure)
+            self._depart_dispatch[node_class] = method
+        return method(node)
+
     # generic visit and depart methods
     # --------------------------------
     simple_nodes = (
@@ -276,15 +346,35 @@ class JupyterCodeTranslator(docutils.nodes.GenericNodeVisitor):
                 "Set kernel as default(python3)")
             self.lang = self.default_lang
 
+        # Welcome block and metadata go in front of the document's cells
+        front_cells = []
+
+        welcome_block = self.builder._welcome_block
+        if welcome_block is not None:
+            front_cells.append(_mk_markdown_cell(welcome_block))
+
+        if self.jupyter_write_metadata:
+            meta_text = \
+                "Notebook created: {:%Y-%m-%d %H:%M:%S}  \n"\
+                "Generated from: {}  "
+
+            metadata = meta_text.format(
+                datetime.datetime.now(),
+                self.source_file_name)
+
+            front_cells.append(_mk_markdown_cell(metadata))
+
+        self._cells[0:0] = front_cells
+
         # Header(insert after metadata)
         if self.jupyter_headers is not None:
-            try:
-                for h in self.jupyter_headers[self.lang][::-1]:
-                    if self.jupyter_write_metadata:
-                        self.output["cells"].insert(1, h)
-                    else:
-                        self.output["cells"].insert(0, h)
-            except:
+            headers = self.jupyter_headers.get(self.lang)
+            if headers is not None:
+                header_index = 1 if self.jupyter_write_metadata else 0
+                # copies, since writing the notebook modifies its cells
+                for h in reversed(headers):
+                    self._cells.insert(header_index, copy.deepcopy(h))
+            else:
                 self.warn(
                     "Invalid jupyter headers. "
                     "jupyter_headers: {}, lang: {}"
@@ -292,10 +382,10 @@ class JupyterCodeTranslator(docutils.nodes.GenericNodeVisitor):
 
         # Update metadata
         if self.jupyter_kernels is not None:
-            try:
-                self.output.metadata.kernelspec = \
-                    self.jupyter_kernels[self.lang]["kernelspec"]
-            except:
+            kernel = self.jupyter_kernels.get(self.lang)
+            if kernel is not None and "kernelspec" in kernel:
+                self.output.metadata.kernelspec = kernel["kernelspec"]
+            else:
                 self.warn(
                     "Invalid jupyter kernels. "
                     "jupyter_kernels: {}, lang: {}"
@@ -360,15 +450,17 @@ class JupyterCodeTranslator(docutils.nodes.GenericNodeVisitor):
             #
             # It is assumed that code cells may only have one output block - any more than
             # one will raise a warning and be ignored.
-            mostRecentCell = self.output["cells"][-1]
-            if mostRecentCell.cell_type != "code":
+            mostRecentCell = self._cells[-1] if self._cells else None
+            if mostRecentCell is None:
+                self.warn("Warning: Class: output block found at the start of the document. Outputs may only come after code cells.")
+            elif mostRecentCell.cell_type != "code":
                 self.warn("Warning: Class: output block found after a " + mostRecentCell.cell_type + " cell. Outputs may only come after code cells.")
             elif mostRecentCell.outputs:
                 self.warn("Warning: Multiple class: output blocks found after a code cell. Each code cell may only be followed by either zero or one output blocks.")
             else:
                 mostRecentCell.outputs.append(new_code_cell)
         else:
-            self.output["cells"].append(new_code_cell)
+            self._cells.append(new_code_cell)
 
         self.in_code_block = False
 
@@ -378,20 +470,30 @@ class JupyterCodeTranslator(docutils.nodes.GenericNodeVisitor):
     # ===================
     @staticmethod
     def strip_blank_lines_in_end_of_block(line_text):
-        lines = line_text.split("\n")
+        # cut at the end of the last line with any non-blank content,
+        # keeping that line's own trailing whitespace
+        content_end = len(line_text.rstrip())
+        if content_end == 0:
+            return ""
 
-        for line in range(len(lines)):
-            if len(lines[-1].strip()) == 0:
-                lines = lines[:-1]
-            else:
-                break
+        line_end = line_text.find("\n", content_end)
+        if line_end == -1:
+            return line_text
 
-        return "\n".join(lines)
+        return line_text[:line_end]
 
 
 class JupyterTranslator(JupyterCodeTranslator):
 
-    SPLIT_URI_ID_REGEX = re.compile(r"([^\#]*)\#?(.*)")
+    __slots__ = (
+        "sep_lines", "sep_paras", "indent_char", "indent", "default_ext",
+        "markdown_buffer", "indents", "section_level", "bullets",
+        "list_item_starts", "in_topic", "reference_text_start",
+        "in_reference", "list_level", "in_citation")
+
+    # precomputed heading prefixes and indent strings
+    _HEADER_PREFIXES = tuple("#" * i + " " for i in range(8))
+    _INDENTS = tuple(" " * i for i in range(32))
 
     def __init__(self, builder, document):
         super().__init__(builder, document)
@@ -407,7 +509,7 @@ class JupyterTranslator(JupyterCodeTranslator):
         self.in_code_block = False  # if False, it means in markdown_cell
         self.code_lines = []
 
-        self.markdown_lines = []
+        self.markdown_buffer = io.StringIO()
 
         self.indents = []
         self.section_level = 0
@@ -461,7 +563,7 @@ class JupyterTranslator(JupyterCodeTranslator):
         if self.in_code_block:
             self.code_lines.append(text)
         else:
-            self.markdown_lines.append(text)
+            self.markdown_buffer.write(text)
             
     def depart_Text(self, node):
         pass
@@ -469,14 +571,14 @@ class JupyterTranslator(JupyterCodeTranslator):
     # image
     def visit_image(self, node):
         uri = node.attributes["uri"]
-        self.markdown_lines.append("![{0}]({0})".format(uri))
+        self.markdown_buffer.write("![{0}]({0})".format(uri))
 
     # math
     def visit_math(self, node):
         """inline math"""
         math_text = node.attributes["latex"].strip()
         formatted_text = "$ {} $".format(math_text)
-        self.markdown_lines.append(formatted_text)
+        self.markdown_buffer.write(formatted_text)
 
     def visit_displaymath(self, node):
         """directive math"""
@@ -493,14 +595,14 @@ class JupyterTranslator(JupyterCodeTranslator):
                          + formatted_text\
                          + "</td><td width=25% style='text-align:center !important;'>"
 
-        self.markdown_lines.append(formatted_text)
+        self.markdown_buffer.write(formatted_text)
 
         # Add the line number reference.
         if node["ids"]:
             referenceBuilder = "(" + str(node["number"]) + ")"
-            self.markdown_lines.append(referenceBuilder)
+            self.markdown_buffer.write(referenceBuilder)
 
-        self.markdown_lines.append("</td></tr></table>")
+        self.markdown_buffer.write("</td></tr></table>")
 
     def visit_raw(self, node):
         pass
@@ -516,60 +618,61 @@ class JupyterTranslator(JupyterCodeTranslator):
 
     def depart_paragraph(self, node):
         if self.list_level > 0:
-            self.markdown_lines.append(self.sep_lines)
+            self.markdown_buffer.write(self.sep_lines)
         else:
-            self.markdown_lines.append(self.sep_paras)
+            self.markdown_buffer.write(self.sep_paras)
 
     # title(section)
     def visit_title(self, node):
         self.add_markdown_cell()
 
         if self.in_topic:
-            self.markdown_lines.append(
-                "{} ".format("#" * (self.section_level+1)))
+            self.markdown_buffer.write(
+                self.header_prefix(self.section_level+1))
         else:
-            self.markdown_lines.append(
-                "{} ".format("#" * self.section_level))
+            self.markdown_buffer.write(
+                self.header_prefix(self.section_level))
 
     def depart_title(self, node):
-        self.markdown_lines.append(self.sep_paras)
+        self.markdown_buffer.write(self.sep_paras)
 
     # emphasis(italic)
     def visit_emphasis(self, node):
-        self.markdown_lines.append("*")
+        self.markdown_buffer.write("*")
 
     def depart_emphasis(self, node):
-        self.markdown_lines.append("*")
+        self.markdown_buffer.write("*")
 
     # strong(bold)
     def visit_strong(self, node):
-        self.markdown_lines.append("**")
+        self.markdown_buffer.write("**")
 
     def depart_strong(self, node):
-        self.markdown_lines.append("**")
+        self.markdown_buffer.write("**")
 
     # figures
     def visit_figure(self, node):
         pass
 
     def depart_figure(self, node):
-        self.markdown_lines.append(self.sep_lines)
+        self.markdown_buffer.write(self.sep_lines)
     
     # reference
     def visit_reference(self, node):
         """anchor link"""
         self.in_reference = True
-        self.markdown_lines.append("[")
-        self.reference_text_start = len(self.markdown_lines)
+        self.markdown_buffer.write("[")
+        self.reference_text_start = self.markdown_buffer.tell()
         
     def depart_reference(self, node):
         if self.in_topic:
             # Jupyter Notebook uses the target text as its id
-            uri_text = "".join(self.markdown_lines[self.reference_text_start:]).strip()
-            uri_text = re.sub(
-                self.URI_SPACE_REPLACE_FROM, self.URI_SPACE_REPLACE_TO, uri_text)
+            self.markdown_buffer.seek(self.reference_text_start)
+            uri_text = self.markdown_buffer.read().strip()
+            uri_text = self.URI_SPACE_REPLACE_FROM.sub(
+                self.URI_SPACE_REPLACE_TO, uri_text)
             formatted_text = "](#{})".format(uri_text)
-            self.markdown_lines.append(formatted_text)
+            self.markdown_buffer.write(formatted_text)
             
         else:
             # if refuri exists, then it includes id reference(#hoge)
@@ -589,7 +692,7 @@ class JupyterTranslator(JupyterCodeTranslator):
                     self.error("Invalid reference")
                     refuri = ""
 
-            self.markdown_lines.append("]({})".format(refuri))
+            self.markdown_buffer.write("]({})".format(refuri))
             
         self.in_reference = False
 
@@ -597,7 +700,7 @@ class JupyterTranslator(JupyterCodeTranslator):
     def visit_target(self, node):
         if "refid" in node.attributes:
             refid = node.attributes["refid"]
-            self.markdown_lines.append(
+            self.markdown_buffer.write(
                 "\n<a id='{}'></a>\n".format(refid))
 
     # list items
@@ -610,7 +713,7 @@ class JupyterTranslator(JupyterCodeTranslator):
     def depart_bullet_list(self, node):
         self.list_level -= 1
         if self.list_level == 0:
-            self.markdown_lines.append(self.sep_paras)
+            self.markdown_buffer.write(self.sep_paras)
             if self.in_topic:
                 self.add_markdown_cell()
         
@@ -626,7 +729,7 @@ class JupyterTranslator(JupyterCodeTranslator):
     def depart_enumerated_list(self, node):
         self.list_level -= 1
         if self.list_level == 0:
-            self.markdown_lines.append(self.sep_paras)
+            self.markdown_buffer.write(self.sep_paras)
 
         self.bullets.pop()
         self.indents.pop()
@@ -634,47 +737,60 @@ class JupyterTranslator(JupyterCodeTranslator):
     def visit_list_item(self, node):
         # self.first_line_in_list_item = True
         head = "{} ".format(self.bullets[-1])
-        self.markdown_lines.append(head)
-        self.list_item_starts.append(len(self.markdown_lines))
+        self.markdown_buffer.write(head)
+        self.list_item_starts.append(self.markdown_buffer.tell())
 
     def depart_list_item(self, node):
         # self.first_line_in_list_item = False
 
         list_item_start = self.list_item_starts.pop()
-        indent = self.indent_char * self.indents[-1]
-        br_removed_flag = False
-        
+
+        # never seek past the end: writing there would pad with NULs
+        buffer_end = self.markdown_buffer.seek(0, io.SEEK_END)
+        if list_item_start is None or list_item_start > buffer_end:
+            list_item_start = buffer_end
+        indent = self.indent_string(self.indents[-1])
+
+        self.markdown_buffer.seek(list_item_start)
+        item_text = self.markdown_buffer.read()
+
         # remove last breakline
-        if self.markdown_lines[-1][-1] == "\n":
-            br_removed_flag = True
-            self.markdown_lines[-1] = self.markdown_lines[-1][:-1]
+        br_removed_flag = item_text.endswith("\n")
+        if br_removed_flag:
+            item_text = item_text[:-1]
 
-        for i in range(list_item_start, len(self.markdown_lines)):
-            self.markdown_lines[i] = self.markdown_lines[i].replace(
-                "\n", "\n{}".format(indent))
+        # single-line item: nothing to indent, the buffer is already final
+        if "\n" not in item_text:
+            self.markdown_buffer.seek(0, io.SEEK_END)
+            return
+
+        # indent the whole list item in a single pass
+        self.markdown_buffer.seek(list_item_start)
+        self.markdown_buffer.truncate()
+        self.markdown_buffer.write(item_text.replace("\n", "\n" + indent))
 
         # add breakline
         if br_removed_flag:
-            self.markdown_lines.append("\n")
+            self.markdown_buffer.write("\n")
 
     # definition list
     def visit_definition_list(self, node):
-        self.markdown_lines.append("\n<dl style='margin: 20px 0;'>\n")
+        self.markdown_buffer.write("\n<dl style='margin: 20px 0;'>\n")
 
     def depart_definition_list(self, node):
-        self.markdown_lines.append("\n</dl>{}".format(self.sep_paras))
+        self.markdown_buffer.write("\n</dl>{}".format(self.sep_paras))
 
     def visit_term(self, node):
-        self.markdown_lines.append("<dt>")
+        self.markdown_buffer.write("<dt>")
 
     def depart_term(self, node):
-        self.markdown_lines.append("</dt>\n")
+        self.markdown_buffer.write("</dt>\n")
 
     def visit_definition(self, node):
-        self.markdown_lines.append("<dd>\n")
+        self.markdown_buffer.write("<dd>\n")
 
     def depart_definition(self, node):
-        self.markdown_lines.append("</dd>\n")
+        self.markdown_buffer.write("</dd>\n")
 
     # field list
     def visit_field_list(self, node):
@@ -706,7 +822,7 @@ class JupyterTranslator(JupyterCodeTranslator):
             else:
                 id_text = id_text[:-1]
 
-            self.markdown_lines.append(
+            self.markdown_buffer.write(
                 "<a id='{}'></a>\n".format(id_text))
 
     def depart_citation(self, node):
@@ -715,11 +831,11 @@ class JupyterTranslator(JupyterCodeTranslator):
     # label
     def visit_label(self, node):
         if self.in_citation:
-            self.markdown_lines.append("\[")
+            self.markdown_buffer.write("\[")
 
     def depart_label(self, node):
         if self.in_citation:
-            self.markdown_lines.append("\] ")
+            self.markdown_buffer.write("\] ")
 
     # ================
     #  code blocks are implemented in the superclass.
@@ -737,22 +853,41 @@ class JupyterTranslator(JupyterCodeTranslator):
     def add_markdown_cell(self):
         """split a markdown cell here
 
-        * append `markdown_lines` to notebook
-        * reset `markdown_lines`
+        * append `markdown_buffer` to notebook
+        * reset `markdown_buffer`
         """
-        line_text = "".join(self.markdown_lines)
+        line_text = self.markdown_buffer.getvalue()
         formatted_line_text = self.strip_blank_lines_in_end_of_block(line_text)
 
         if len(formatted_line_text.strip()) > 0:
-            new_md_cell = nbformat.v4.new_markdown_cell(formatted_line_text)
-            self.output["cells"].append(new_md_cell)
-            self.markdown_lines = []
+            new_md_cell = _mk_markdown_cell(formatted_line_text)
+            self._cells.append(new_md_cell)
+            self.markdown_buffer.seek(0)
+            self.markdown_buffer.truncate()
+
+            # offsets into the flushed text are stale; open list items have
+            # nothing left in the buffer to re-indent
+            self.list_item_starts = [None] * len(self.list_item_starts)
+            self.reference_text_start = 0
+
+    @classmethod
+    def header_prefix(cls, level):
+        if level < len(cls._HEADER_PREFIXES):
+            return cls._HEADER_PREFIXES[level]
+        return "#" * level + " "
+
+    def indent_string(self, width):
+        if self.indent_char == " " and width < len(self._INDENTS):
+            return self._INDENTS[width]
+        return self.indent_char * width
 
     @classmethod
     def split_uri_id(cls, uri):
-        return re.search(cls.SPLIT_URI_ID_REGEX, uri).groups()
+        uri, _, id_ = uri.partition("#")
+        return uri, id_
 
     @classmethod
+    @functools.lru_cache(maxsize=1024)
     def add_extension_to_inline_link(cls, uri, ext):
         if "." not in uri:
             uri, id_ = cls.split_uri_id(uri)
@@ -770,6 +905,10 @@ class JupyterBuilder(Builder):
     out_suffix = ".ipynb"
     allow_parallel = True
 
+    # thread pool used to stat source and target files in get_outdated_docs
+    stat_pool_min_docs = 200
+    stat_pool_max_workers = 8
+
     _writer_class = JupyterWriter
 
     def init(self):
@@ -777,33 +916,91 @@ class JupyterBuilder(Builder):
         pass
 
     def get_outdated_docs(self):
+        candidates = []
         for docname in self.env.found_docs:
             if docname not in self.env.all_docs:
                 yield docname
                 continue
-            targetname = self.env.doc2path(docname, self.outdir,
-                                           self.out_suffix)
-            try:
-                targetmtime = os.path.getmtime(targetname)
-            except Exception:
-                targetmtime = 0
-            try:
-                srcmtime = os.path.getmtime(self.env.doc2path(docname))
-                if srcmtime > targetmtime:
-                    yield docname
-            except EnvironmentError:
-                pass
+            candidates.append(docname)
+
+        # stat calls are I/O bound, so overlap them on slow (networked)
+        # disks; not worth starting threads for small projects
+        if len(candidates) < self.stat_pool_min_docs:
+            outdated = [self._is_outdated(docname) for docname in candidates]
+        else:
+            with ThreadPoolExecutor(
+                    max_workers=self.stat_pool_max_workers) as executor:
+                outdated = list(executor.map(self._is_outdated, candidates))
+
+        for docname, is_outdated in zip(candidates, outdated):
+            if is_outdated:
+                yield docname
+
+    def _is_outdated(self, docname):
+        try:
+            srcmtime = os.stat(self.env.doc2path(docname)).st_mtime
+        except OSError:
+            return False
+
+        targetname = self.env.doc2path(docname, self.outdir,
+                                       self.out_suffix)
+        try:
+            targetmtime = os.stat(targetname).st_mtime
+        except OSError:
+            # no (readable) output yet
+            return True
+
+        return srcmtime > targetmtime
 
     def get_target_uri(self, docname, typ=None):
         return docname
 
     def prepare_writing(self, docnames):
+        # shared, read-only after construction
+        self._lang_translator = LanguageTranslator(self.config["templates_path"])
+        self._welcome_block = self.load_welcome_block()
         self.writer = self._writer_class(self)
 
+        # for small projects, merging worker results costs more than the
+        # parallel write saves
+        if len(docnames) <= self.config["jupyter_parallel_min_docs"]:
+            self.parallel_ok = False
+
+    def load_welcome_block(self):
+        """read the welcome block once for all documents
+
+        Returns the formatted markdown text, or None if no welcome block is
+        configured or found in the template paths.
+        """
+        welcome_block_filename = self.config["jupyter_welcome_block"]
+        if not welcome_block_filename:
+            return None
+
+        full_path_to_welcome = None
+        for template_path in self.config["templates_path"]:
+            if os.path.isfile(template_path + "/" + welcome_block_filename):
+                full_path_to_welcome = os.path.normpath(template_path + "/" + welcome_block_filename)
+
+        if not full_path_to_welcome:
+            return None
+
+        with open(full_path_to_welcome) as input_file:
+            line_text = input_file.read()
+
+        return JupyterCodeTranslator.strip_blank_lines_in_end_of_block(line_text)
+
     def write_doc(self, docname, doctree):
         # work around multiple string % tuple issues in docutils;
-        # replace tuples in attribute values with lists
-        doctree = doctree.deepcopy()
+        # replace tuples in attribute values with lists. The doctree is
+        # freshly loaded for this write, so it is safe to modify in place.
+        for node in doctree.traverse(docutils.nodes.Element):
+            for att, value in node.attributes.items():
+                if isinstance(value, tuple):
+                    node.attributes[att] = value = list(value)
+                if isinstance(value, list):
+                    for i, val in enumerate(value):
+                        if isinstance(val, tuple):
+                            value[i] = list(val)
         destination = docutils.io.StringOutput(encoding="utf-8")
         self.writer.write(doctree, destination)
         outfilename = os.path.join(
@@ -812,12 +1009,43 @@ class JupyterBuilder(Builder):
         # mkdir if the directory does not exist
         ensuredir(os.path.dirname(outfilename))
 
+        notebook = self.writer.output
+        if self.config["jupyter_validate"]:
+            try:
+                nbformat.validate(notebook)
+            except nbformat.ValidationError as err:
+                self.warn("invalid notebook %s: %s" % (outfilename, err))
+
         try:
-            with codecs.open(outfilename, "w", "utf-8") as f:
-                f.write(self.writer.output)
+            with open(outfilename, "w", encoding="utf-8", buffering=1 << 20) as f:
+                self.dump_notebook(notebook, f)
         except (IOError, OSError) as err:
             self.warn("error writing file %s: %s" % (outfilename, err))
 
+    def _write_parallel(self, *args, **kwargs):
+        # Sphinx caps write chunks at 10 documents and has no hook to change
+        # that, so swap in our batch size while the base class runs
+        default_make_chunks = sphinx.builders.make_chunks
+        maxbatch = self.config["jupyter_parallel_batch_size"]
+
+        def make_chunks(arguments, nproc, *_args, **_kwargs):
+            return default_make_chunks(arguments, nproc, maxbatch=maxbatch)
+
+        sphinx.builders.make_chunks = make_chunks
+        try:
+            Builder._write_parallel(self, *args, **kwargs)
+        finally:
+            sphinx.builders.make_chunks = default_make_chunks
+
+    @staticmethod
+    def dump_notebook(notebook, f):
+        """write `notebook` to `f` in the same JSON layout as nbformat.write
+        """
+        json.dump(split_lines(notebook), f,
+                  indent=1, sort_keys=True, separators=(",", ": "),
+                  ensure_ascii=False)
+        f.write("\n")
+
     def copy_static_files(self):
         # copy all static files
         self.info(bold("copying static files... "), nonl=True)
@@ -839,15 +1067,9 @@ class JupyterBuilder(Builder):
 
 
 def get_source_file_name(filepath, srcdir):
-    file_path_list = filepath.split("/")
-    srcdir_path_list = srcdir.split("/")
-
-    for i in range(len(srcdir_path_list)):
-        if srcdir_path_list[i] != file_path_list[i]:
-            raise ValueError("File path does not exist in the source directory")
-    
-    file_name_list = file_path_list[len(srcdir_path_list)-1:]
-    return "/".join(file_name_list)
+    # path relative to the parent of srcdir, so it starts with srcdir's name
+    parent_dir = os.path.dirname(srcdir.rstrip("/\\"))
+    return os.path.relpath(filepath, parent_dir).replace(os.sep, "/")
 
 
 def setup(app):
@@ -858,6 +1080,9 @@ def setup(app):
     app.add_config_value("jupyter_write_metadata", True, "jupyter")
     app.add_config_value("jupyter_static_file_path", [], "jupyter")
     app.add_config_value("jupyter_welcome_block", None, "jupyter")
+    app.add_config_value("jupyter_parallel_batch_size", 200, "jupyter")
+    app.add_config_value("jupyter_parallel_min_docs", 500, "jupyter")
+    app.add_config_value("jupyter_validate", False, "jupyter")
 
     return {
         "version": "0.0.1",